@@ -1,13 +1,24 @@
 # main.py — SpeciesNet (Google Camera Trap AI) for bird ID via --folders
-import os, time, logging, json, subprocess, argparse
-from typing import List, Dict, Optional
+import os, sys, time, logging, subprocess, argparse, atexit, threading, queue
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 from openai import OpenAI
 import tempfile
+import importlib.metadata
+import shutil
 from pathlib import Path
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import ijson
+import orjson
+import diskcache
 from fastapi import FastAPI, Query
 from pydantic import BaseModel
 
@@ -27,7 +38,16 @@ SUPABASE_KEY = os.environ["SUPABASE_ANON_KEY"]
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "50"))
 CONFIDENCE_THRESHOLD = float(os.getenv("THRESHOLD", "0.30"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "5"))
+INFERENCE_CHUNK_SIZE = int(os.getenv("INFERENCE_CHUNK_SIZE", "32"))
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", ".speciesnet_cache")
+# Also read by speciesnet_worker.py (inherited env); empty means the package default
+SPECIESNET_MODEL = os.getenv("SPECIESNET_MODEL", "")
 MODEL_VERSION = "speciesnet-ensemble"
+OPENAI_MODEL = "gpt-5"
+
+SPECIESNET_WORKER_SCRIPT = Path(__file__).with_name("speciesnet_worker.py")
 
 # Geofencing: Long Island, NY
 LOCATION = {"country": "USA", "admin1_region": "NY"}
@@ -37,20 +57,52 @@ app = FastAPI()
 sb: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
-BLOCKLIST = {"blank", "unknown", "vehicle", "human", "person", "animal", "cyanocitta species", "eastern gray squirrel", "no cv result"}
+# Per-URL SpeciesNet and OpenAI results, so images seen before skip inference
+prediction_cache = diskcache.Cache(PREDICTION_CACHE_DIR)
+
+# Shared keep-alive pool for image downloads and outbound notifications
+http_session = requests.Session()
+http_session.headers["User-Agent"] = "chirpchirp/1.0"
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=DOWNLOAD_WORKERS,
+    pool_maxsize=max(DOWNLOAD_WORKERS, 32),
+    max_retries=Retry(total=3, backoff_factor=0.2),
+))
+
+# Rate-limit / upstream-unavailable responses and PostgREST's "database unreachable"
+# codes; anything else fails immediately. APIError.code only carries the HTTP status
+# for non-JSON bodies, so the status is recorded from the response itself.
+RETRYABLE_SUPABASE_STATUSES = {429, 502, 503, 504}
+RETRYABLE_SUPABASE_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+_supabase_status = threading.local()
+
+# Lower-case names; checked against species_name.lower() once per label
+BLOCKLIST = frozenset({"blank", "unknown", "vehicle", "human", "person", "animal", "cyanocitta species", "eastern gray squirrel", "no cv result"})
  
 
 # ---- Helpers ----
 def download_image(url: str, output_path: Path) -> bool:
     try:
-        r = requests.get(url, timeout=20)
-        r.raise_for_status()
-        output_path.write_bytes(r.content)
+        with http_session.get(url, timeout=20, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with output_path.open("wb") as f:
+                length = int(r.headers.get("Content-Length") or 0)
+                if length and hasattr(os, "posix_fallocate"):
+                    # Reserve the whole file up front to avoid fragmented extents
+                    try:
+                        os.posix_fallocate(f.fileno(), 0, length)
+                    except OSError:
+                        pass
+                shutil.copyfileobj(r.raw, f, length=1 << 16)
+                # A compressed Content-Length may have over-reserved the file
+                f.truncate()
         return True
     except Exception as e:
         logger.error(f"Failed to download {url}: {e}")
         return False
 
+@lru_cache(maxsize=4096)
 def _extract_species_name(label: str) -> str:
     """Return only the last part of a semicolon-delimited taxonomy path."""
     if not label:
@@ -59,16 +111,39 @@ def _extract_species_name(label: str) -> str:
     name = parts[-1] if parts else label
     return name.replace("_", " ").title()
 
+def _normalize_openai_predictions(results) -> List[Dict]:
+    """Keep only entries shaped like {"name": str, "confidence": number} from an OpenAI reply."""
+    if not isinstance(results, list):
+        return []
+    normalized = []
+    for r in results:
+        if not isinstance(r, dict):
+            continue
+        name = r.get("name")
+        try:
+            confidence = float(r.get("confidence"))
+        except (TypeError, ValueError):
+            continue
+        if isinstance(name, str) and name.strip():
+            normalized.append({"name": name.strip(), "confidence": confidence})
+    return normalized
+
 def classify_with_openai(image_url: str) -> List[Dict]:
     """Fallback to OpenAI vision when SpeciesNet returns generic 'Bird'."""
     if not openai_client:
         logger.warning("OpenAI API key not configured, skipping fallback")
         return []
     
+    cache_key = ("openai", OPENAI_MODEL, image_url)
+    results = prediction_cache.get(cache_key)
+    if results is not None:
+        logger.info("♻️  Using cached OpenAI predictions")
+        return [r for r in _normalize_openai_predictions(results) if r["confidence"] >= CONFIDENCE_THRESHOLD]
+    
     try:
         logger.info("🔄 Falling back to OpenAI vision...")
         response = openai_client.chat.completions.create(
-            model="gpt-5",
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "user",
@@ -93,8 +168,9 @@ def classify_with_openai(image_url: str) -> List[Dict]:
         if "[" in content and "]" in content:
             start = content.index("[")
             end = content.rindex("]") + 1
-            results = json.loads(content[start:end])
-            filtered = [r for r in results if r.get("confidence", 0) >= CONFIDENCE_THRESHOLD]
+            results = _normalize_openai_predictions(orjson.loads(content[start:end]))
+            prediction_cache.set(cache_key, results)
+            filtered = [r for r in results if r["confidence"] >= CONFIDENCE_THRESHOLD]
             
             if filtered:
                 logger.info("OpenAI predictions:")
@@ -103,54 +179,170 @@ def classify_with_openai(image_url: str) -> List[Dict]:
             
             return filtered
         
+        prediction_cache.set(cache_key, [])
         return []
         
     except Exception as e:
         logger.error(f"OpenAI fallback error: {e}")
         return []
 
-def run_speciesnet_on_folder(image_dir: Path, output_json: Path) -> bool:
-    """Run SpeciesNet in folder mode with geofencing."""
-    cmd = [
-        "python", "-m", "speciesnet.scripts.run_model",
-        "--folders", str(image_dir),
-        "--predictions_json", str(output_json),
-        "--country", LOCATION["country"],
-        "--admin1_region", LOCATION["admin1_region"],
-    ]
-    logger.info("Running SpeciesNet (folder mode)...")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        logger.error(
-            "SpeciesNet failed.\n"
-            f"CMD: {' '.join(cmd)}\n"
-            f"STDOUT:\n{result.stdout}\n"
-            f"STDERR:\n{result.stderr}"
+class SpeciesNetWorker:
+    """
+    Long-lived SpeciesNet subprocess (see speciesnet_worker.py).
+
+    The model is loaded once when the worker starts and stays resident across
+    batches, so only the first job pays interpreter startup and model load.
+    A worker that dies is restarted on the next job. When `device` is set the
+    worker only sees that GPU (via CUDA_VISIBLE_DEVICES).
+    """
+
+    def __init__(self, device: Optional[str] = None):
+        self.device = device
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        logger.info(f"Starting SpeciesNet worker{self.label} (loading model)...")
+        env = None
+        if self.device is not None:
+            env = {**os.environ, "CUDA_VISIBLE_DEVICES": self.device}
+        self._proc = subprocess.Popen(
+            [sys.executable, str(SPECIESNET_WORKER_SCRIPT)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=env,
         )
-        return False
-    return True
+        if not self._proc.stdout.readline():
+            self.stop()
+            raise RuntimeError(f"SpeciesNet worker{self.label} exited during startup")
+        logger.info(f"SpeciesNet worker{self.label} ready")
+
+    @property
+    def label(self) -> str:
+        return f" [GPU {self.device}]" if self.device is not None else ""
+
+    def predict(
+        self,
+        output_json: Path,
+        folders: Optional[List[Path]] = None,
+        filepaths: Optional[List[Path]] = None
+    ) -> bool:
+        """Run one inference job; predictions are written to output_json."""
+        job = {
+            "folders": [str(f) for f in folders] if folders else None,
+            "filepaths": [str(f) for f in filepaths] if filepaths else None,
+            "predictions_json": str(output_json),
+            "country": LOCATION["country"],
+            "admin1_region": LOCATION["admin1_region"],
+        }
+        with self._lock:
+            try:
+                self._ensure_started()
+                self._proc.stdin.write(orjson.dumps(job).decode() + "\n")
+                self._proc.stdin.flush()
+                reply = self._proc.stdout.readline()
+            except Exception as e:
+                logger.error(f"SpeciesNet worker error: {e}")
+                self.stop()
+                return False
+            if not reply:
+                logger.error("SpeciesNet worker exited mid-job; it will be restarted on the next run")
+                self.stop()
+                return False
+        result = orjson.loads(reply)
+        if not result.get("done"):
+            logger.error(f"SpeciesNet failed: {result.get('error')}")
+            return False
+        return True
+
+    def stop(self):
+        proc, self._proc = self._proc, None
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=10)
+        except Exception:
+            proc.kill()
+
+def _detect_gpus() -> List[str]:
+    """GPU ids to pin one SpeciesNet worker to each; empty means a single unpinned worker."""
+    visible = os.getenv("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        return [d.strip() for d in visible.split(",") if d.strip() and d.strip() != "-1"]
+    try:
+        listing = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10).stdout
+    except Exception:
+        return []
+    return [str(i) for i, line in enumerate(l for l in listing.splitlines() if l.startswith("GPU "))]
+
+_workers_lock = threading.Lock()
+_speciesnet_workers: List[SpeciesNetWorker] = []
+_idle_workers: "queue.Queue[SpeciesNetWorker]" = queue.Queue()
+
+def get_speciesnet_workers() -> List[SpeciesNetWorker]:
+    """
+    One worker per GPU (data-parallel); jobs go to whichever worker is idle.
+    GPUs are detected on first use, so importing this module never shells out to nvidia-smi.
+    """
+    with _workers_lock:
+        if not _speciesnet_workers:
+            gpus = _detect_gpus()
+            _speciesnet_workers.extend(
+                [SpeciesNetWorker(d) for d in gpus] if len(gpus) > 1 else [SpeciesNetWorker()]
+            )
+            for worker in _speciesnet_workers:
+                _idle_workers.put(worker)
+                atexit.register(worker.stop)
+        return _speciesnet_workers
+
+def run_speciesnet_on_files(filepaths: List[Path], output_json: Path) -> bool:
+    """Run SpeciesNet on specific image files with geofencing, on the next idle worker."""
+    get_speciesnet_workers()
+    worker = _idle_workers.get()
+    try:
+        logger.info(f"Running SpeciesNet on {len(filepaths)} images{worker.label}...")
+        return worker.predict(output_json, filepaths=filepaths)
+    finally:
+        _idle_workers.put(worker)
+
+def _iter_speciesnet_predictions(output_json: Path):
+    """Stream entries of predictions.json one at a time instead of loading the whole file."""
+    with output_json.open("rb") as f:
+        yield from ijson.items(f, "predictions.item", use_float=True)
 
 def parse_speciesnet_output(
     output_json: Path,
-    path_to_image_id: Dict[str, str],
+    name_to_image_id: Dict[str, str],
     threshold: float
 ) -> Dict[str, List[Dict]]:
     """
     Parse predictions.json into {image_id: [rows]}.
+    Predictions are matched to images by file name (e.g. "<image_id>.jpg").
     Only returns the last element of a semicolon-delimited taxonomy path.
     """
     if not output_json.exists():
         return {}
 
-    data = json.loads(output_json.read_text())
-    preds = data.get("predictions", []) or []
-    per_image: Dict[str, List[Dict]] = defaultdict(list)
+    # {image_id: {lower-cased name: row}}: dedup on insert, keeping the highest confidence
+    best: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+
+    def _keep(image_id: str, key: str, name: str, confidence: float):
+        current = best[image_id].get(key)
+        if current is None or confidence > current["confidence"]:
+            best[image_id][key] = {"name": name, "confidence": confidence}
 
-    logger.info(f"📊 Parsing {len(preds)} predictions from SpeciesNet output...")
+    logger.info("📊 Parsing predictions from SpeciesNet output...")
 
-    for p in preds:
+    parsed = 0
+    for p in _iter_speciesnet_predictions(output_json):
+        parsed += 1
         filepath = p.get("filepath")
-        image_id = path_to_image_id.get(filepath)
+        image_id = name_to_image_id.get(os.path.basename(filepath or ""))
         if not image_id:
             logger.debug(f"Skipping {filepath} - no matching image_id")
             continue
@@ -160,17 +352,16 @@ def parse_speciesnet_output(
 
         # Clean up the label for display
         species_name = _extract_species_name(label)
+        species_lower = species_name.lower()
         
         # Log the primary prediction for this image
         logger.info(f"🖼️  Image {image_id}: Primary prediction = {species_name} (confidence: {score:.2%}, threshold: {threshold:.2%})")
 
-        if species_name.lower() not in BLOCKLIST and (score or 0.0) >= threshold:
-            per_image[image_id].append({
-                "name": species_name,
-                "confidence": float(score)
-            })
+        blocked = species_lower in BLOCKLIST
+        if not blocked and (score or 0.0) >= threshold:
+            _keep(image_id, species_lower, species_name, float(score))
             logger.info(f"  ✅ Added {species_name} to predictions (above threshold)")
-        elif species_name.lower() in BLOCKLIST:
+        elif blocked:
             logger.info(f"  ⛔ Skipped {species_name} (blocklisted)")
         else:
             logger.info(f"  ⬇️  Skipped {species_name} (below threshold: {score:.2%} < {threshold:.2%})")
@@ -182,58 +373,146 @@ def parse_speciesnet_output(
             classes = cls.get("classes") or []
             scores = cls.get("scores") or []
             logger.info(f"  📋 Classifier top-5 alternatives for {image_id}:")
-            for idx, (alt_label, alt_score) in enumerate(list(zip(classes, scores))[:5], 1):
+            for idx, (alt_label, alt_score) in enumerate(zip(classes[:5], scores[:5]), 1):
                 alt_species = _extract_species_name(alt_label)
-                if alt_species.lower() in BLOCKLIST:
+                alt_lower = alt_species.lower()
+                if alt_lower in BLOCKLIST:
                     logger.info(f"    {idx}. {alt_species} ({alt_score:.2%}) - blocklisted, skipped")
                     continue
                 try:
                     alt_conf = float(alt_score)
                 except Exception:
                     alt_conf = 0.0
-                if alt_conf >= threshold and alt_species != species_name:
-                    per_image[image_id].append({
-                        "name": alt_species,
-                        "confidence": alt_conf
-                    })
+                if alt_conf >= threshold and alt_lower != species_lower:
+                    _keep(image_id, alt_lower, alt_species, alt_conf)
                     logger.info(f"    {idx}. {alt_species} ({alt_conf:.2%}) - ✅ added")
                 else:
-                    reason = "same as primary" if alt_species == species_name else f"below threshold ({alt_conf:.2%} < {threshold:.2%})"
+                    reason = "same as primary" if alt_lower == species_lower else f"below threshold ({alt_conf:.2%} < {threshold:.2%})"
                     logger.info(f"    {idx}. {alt_species} ({alt_conf:.2%}) - ⬇️  skipped ({reason})")
         else:
             logger.info(f"  ⚠️  Classifier failed for {image_id}")
 
-        # Dedup + sort
-        if per_image.get(image_id):
-            uniq = {}
-            for r in per_image[image_id]:
-                k = r["name"].lower()
-                if k not in uniq or r["confidence"] > uniq[k]["confidence"]:
-                    uniq[k] = r
-            per_image[image_id] = sorted(uniq.values(), key=lambda x: x["confidence"], reverse=True)
-            logger.info(f"  📊 Final predictions for {image_id}: {len(per_image[image_id])} species")
-            for idx, pred in enumerate(per_image[image_id], 1):
-                logger.info(f"    {idx}. {pred['name']}: {pred['confidence']:.2%}")
+    logger.info(f"📊 Parsed {parsed} predictions from SpeciesNet output")
+
+    # Sort once, after every prediction has been ingested
+    per_image: Dict[str, List[Dict]] = {}
+    for image_id, uniq in best.items():
+        per_image[image_id] = sorted(uniq.values(), key=lambda x: x["confidence"], reverse=True)
+        logger.info(f"  📊 Final predictions for {image_id}: {len(per_image[image_id])} species")
+        for idx, pred in enumerate(per_image[image_id], 1):
+            logger.info(f"    {idx}. {pred['name']}: {pred['confidence']:.2%}")
 
     return per_image
 
-def get_candidate_images(limit: int):
-    images = (sb.table("images")
-                .select("id,image_url,taken_on")
-                .order("taken_on", desc=True)
-                .limit(limit * 2)
-                .execute()).data or []
-    if not images:
-        return []
-    ids = [r["id"] for r in images if r.get("id")]
-    if not ids:
-        return []
-    existing = (sb.table("attributions")
-                  .select("image_id")
-                  .in_("image_id", ids)
-                  .execute()).data or []
-    attributed = {r["image_id"] for r in existing}
-    return [r for r in images if r["id"] not in attributed and r.get("image_url")][:limit]
+def classify_downloaded_images(
+    ready: "queue.Queue[Optional[Path]]",
+    out_dir: Path,
+    name_to_image_id: Dict[str, str]
+) -> Tuple[Dict[str, List[Dict]], List[str]]:
+    """
+    Consume downloaded image paths from `ready` until a None sentinel arrives.
+
+    Each SpeciesNet job takes whatever has been downloaded since the last one
+    (up to INFERENCE_CHUNK_SIZE), so inference overlaps with the remaining
+    downloads. With several GPU workers, one job runs per worker at a time.
+    Returns (per_image predictions, ids of images whose SpeciesNet job failed).
+    """
+    n_workers = len(get_speciesnet_workers())
+    # A chunk is only cut once a worker is free, so waiting images batch up meanwhile
+    slots = threading.Semaphore(n_workers)
+
+    def _classify(filepaths: List[Path], output_json: Path) -> Tuple[Dict[str, List[Dict]], List[str]]:
+        img_ids = [name_to_image_id[p.name] for p in filepaths if p.name in name_to_image_id]
+        try:
+            if run_speciesnet_on_files(filepaths, output_json) and output_json.exists():
+                preds = parse_speciesnet_output(output_json, name_to_image_id, CONFIDENCE_THRESHOLD)
+                # Every image in the job gets an entry, even with nothing above threshold
+                return {img_id: preds.get(img_id, []) for img_id in img_ids}, []
+            logger.warning(f"No predictions generated for {len(filepaths)} images")
+            return {}, img_ids
+        finally:
+            slots.release()
+
+    jobs = []
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        finished = False
+        while not finished:
+            slots.acquire()
+            chunk = [ready.get()]
+            while chunk[-1] is not None and len(chunk) < INFERENCE_CHUNK_SIZE:
+                try:
+                    chunk.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            finished = chunk[-1] is None
+            filepaths = [p for p in chunk if p is not None]
+            if not filepaths:
+                slots.release()
+                continue
+            output_json = out_dir / f"predictions_{len(jobs)}.json"
+            jobs.append(pool.submit(_classify, filepaths, output_json))
+
+    per_image: Dict[str, List[Dict]] = {}
+    failed_ids: List[str] = []
+    for job in jobs:
+        job_preds, job_failed = job.result()
+        per_image.update(job_preds)
+        failed_ids.extend(job_failed)
+    return per_image, failed_ids
+
+def _record_supabase_status(response: httpx.Response):
+    _supabase_status.code = response.status_code
+
+def _execute_with_backoff(query, max_attempts: int = 5):
+    """
+    Execute a Supabase query, backing off exponentially only on retryable errors:
+    HTTP 429/5xx from the gateway, PostgREST connection errors, and transport failures.
+    """
+    # The postgrest client can be recreated (e.g. on auth changes), so hook the query's own session
+    hooks = query.session.event_hooks["response"]
+    if _record_supabase_status not in hooks:
+        hooks.append(_record_supabase_status)
+
+    for attempt in range(max_attempts):
+        _supabase_status.code = None
+        try:
+            return query.execute()
+        except APIError as e:
+            status = _supabase_status.code
+            if status not in RETRYABLE_SUPABASE_STATUSES and str(e.code) not in RETRYABLE_SUPABASE_CODES:
+                raise
+            reason = f"HTTP {status} (code {e.code})"
+            if attempt == max_attempts - 1:
+                raise
+        except httpx.TransportError as e:
+            reason = f"{type(e).__name__}: {e}"
+            if attempt == max_attempts - 1:
+                raise
+        delay = min(2 ** attempt, 30)
+        logger.warning(f"Supabase request failed with {reason}; retrying in {delay}s ({attempt + 1}/{max_attempts})")
+        time.sleep(delay)
+
+@lru_cache(maxsize=1)
+def _speciesnet_model_id() -> str:
+    """The model the worker loads; the package default is pinned to the installed version."""
+    if SPECIESNET_MODEL:
+        return SPECIESNET_MODEL
+    try:
+        return f"default@{importlib.metadata.version('speciesnet')}"
+    except importlib.metadata.PackageNotFoundError:
+        return "default"
+
+def _speciesnet_cache_key(image_url: str) -> tuple:
+    return ("speciesnet", _speciesnet_model_id(), MODEL_VERSION, CONFIDENCE_THRESHOLD, image_url)
+
+def get_candidate_images(limit: int, exclude_ids: Optional[set] = None):
+    """
+    Newest unattributed images with a URL, via the get_unattributed_images RPC (anti-join in SQL).
+    Images in `exclude_ids` are skipped, so continuous mode can page past ones it couldn't attribute.
+    """
+    return _execute_with_backoff(
+        sb.rpc("get_unattributed_images", {"batch_limit": limit, "exclude_ids": sorted(exclude_ids or ())})
+    ).data or []
 
 def check_first_time_species(species_names: List[str]) -> set:
     """Check which species are appearing for the first time. Returns set of new species."""
@@ -242,10 +521,11 @@ def check_first_time_species(species_names: List[str]) -> set:
     
     try:
         # Query to see which species already exist in attributions
-        existing = (sb.table("attributions")
-                     .select("species")
-                     .in_("species", species_names)
-                     .execute()).data or []
+        existing = _execute_with_backoff(
+            sb.table("attributions")
+              .select("species")
+              .in_("species", species_names)
+        ).data or []
         
         existing_species = {r["species"] for r in existing}
         new_species = set(species_names) - existing_species
@@ -264,7 +544,7 @@ def notify_special_sighting(species: str, image_url: str, confidence: float):
             "confidence": confidence
         }
         logger.info(f"🚨 First-time sighting of {species}! Notifying service...")
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_session.post(url, json=payload, timeout=10)
         response.raise_for_status()
         logger.info(f"✅ Special sighting notification sent for {species}")
     except Exception as e:
@@ -280,165 +560,215 @@ def upsert_attributions(image_id: str, species_rows: List[Dict], image_url: str
         image_url: URL of the image (required if check_first_time=True)
         check_first_time: Whether to check and notify about first-time species
     """
-    if not species_rows:
-        return
+    upsert_attributions_bulk(
+        [(image_id, species_rows)],
+        image_urls={image_id: image_url} if image_url else None,
+        check_first_time=check_first_time,
+    )
+
+def upsert_attributions_bulk(
+    pairs: List[Tuple[str, List[Dict]]],
+    image_urls: Optional[Dict[str, str]] = None,
+    check_first_time: bool = False
+) -> int:
+    """
+    Upsert attributions for many images in a single request.
+    
+    Args:
+        pairs: List of (image_id, species_rows) where species_rows are dicts with 'name' and 'confidence'
+        image_urls: Map of image_id to image URL (required if check_first_time=True)
+        check_first_time: Whether to check and notify about first-time species
+    
+    Returns:
+        Number of attribution rows written.
+    """
+    # Keyed on the conflict target so one statement never touches a row twice
+    rows_by_key: Dict[Tuple[str, str], Dict] = {}
+    for image_id, species_rows in pairs:
+        for s in species_rows:
+            rows_by_key[(image_id, s["name"])] = {
+                "image_id": image_id,
+                "model_version": MODEL_VERSION,
+                "species": s["name"],
+                "confidence": s["confidence"],
+                "extra": None,
+            }
+    all_rows = list(rows_by_key.values())
+    if not all_rows:
+        return 0
     
     # Check for first-time species before upserting
     first_time_species = set()
     if check_first_time:
-        species_names = [s["name"] for s in species_rows]
-        first_time_species = check_first_time_species(species_names)
+        first_time_species = check_first_time_species(sorted({r["species"] for r in all_rows}))
     
-    rows = [{
-        "image_id": image_id,
-        "model_version": MODEL_VERSION,
-        "species": s["name"],
-        "confidence": s["confidence"],
-        "extra": None,
-    } for s in species_rows]
-    sb.table("attributions").upsert(rows, on_conflict="image_id,species,model_version").execute()
+    _execute_with_backoff(
+        sb.table("attributions").upsert(all_rows, on_conflict="image_id,species,model_version")
+    )
     
-    # Notify about first-time species after successful upsert
-    if check_first_time and first_time_species and image_url:
-        for species_row in species_rows:
-            if species_row["name"] in first_time_species:
-                notify_special_sighting(species_row["name"], image_url, species_row["confidence"])
-
-def run_batch(batch_size: Optional[int] = None) -> Dict:
-    """Run a single batch of image attributions. Returns stats dict."""
+    # Notify once per first-time species, using its most confident sighting in this batch
+    if check_first_time and first_time_species and image_urls:
+        best: Dict[str, Dict] = {}
+        for r in all_rows:
+            if r["species"] in first_time_species and r["image_id"] in image_urls:
+                if r["species"] not in best or r["confidence"] > best[r["species"]]["confidence"]:
+                    best[r["species"]] = r
+        for species, r in best.items():
+            notify_special_sighting(species, image_urls[r["image_id"]], r["confidence"])
+    
+    return len(all_rows)
+
+def run_batch(batch_size: Optional[int] = None, candidates: Optional[List[Dict]] = None) -> Dict:
+    """Run a single batch of image attributions (fetching candidates unless given). Returns stats dict."""
     actual_batch_size = batch_size or BATCH_SIZE
     logger.info("🪶 Starting bird attribution batch (SpeciesNet)…")
-    candidates = get_candidate_images(actual_batch_size)
+    if candidates is None:
+        candidates = get_candidate_images(actual_batch_size)
     if not candidates:
         logger.info("No images to attribute.")
         return {
             "success": True,
             "images_processed": 0,
             "attributions_created": 0,
+            "unattributed_ids": [],
             "message": "No images to attribute"
         }
 
     logger.info(f"Found {len(candidates)} images to classify")
+    url_by_id = {r["id"]: r["image_url"] for r in candidates}
     attributions_count = 0
 
+    cached: Dict[str, List[Dict]] = {}
+    for img_id, url in url_by_id.items():
+        preds = prediction_cache.get(_speciesnet_cache_key(url))
+        if preds is not None:
+            cached[img_id] = preds
+    if cached:
+        logger.info(f"♻️  {len(cached)} images already classified; skipping download and inference")
+    to_fetch = {img_id: url for img_id, url in url_by_id.items() if img_id not in cached}
+
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_path = Path(temp_dir)
         img_dir = temp_path / "images"
         out_dir = temp_path / "results"
         img_dir.mkdir(parents=True, exist_ok=True)
         out_dir.mkdir(parents=True, exist_ok=True)
-        output_json = out_dir / "predictions.json"
 
-        path_to_image_id: Dict[str, str] = {}
+        # Downloads feed SpeciesNet as they land instead of waiting for the whole batch
+        name_to_image_id = {f"{img_id}.jpg": img_id for img_id in url_by_id}
+        ready: "queue.Queue[Optional[Path]]" = queue.Queue()
         downloaded = 0
-        for idx, row in enumerate(candidates):
-            img_id, url = row["id"], row["image_url"]
-            image_path = img_dir / f"{img_id}.jpg"
-            if download_image(url, image_path):
-                path_to_image_id[str(image_path)] = img_id
-                downloaded += 1
-            else:
-                logger.warning(f"Skip {img_id} (download failed)")
-            
-            # 100ms cooloff between downloads
-            if idx < len(candidates) - 1:
-                time.sleep(0.1)
+        with ThreadPoolExecutor(max_workers=1) as inference:
+            consumer = inference.submit(classify_downloaded_images, ready, out_dir, name_to_image_id)
+            try:
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as ex:
+                    futures = {
+                        ex.submit(download_image, url, img_dir / f"{img_id}.jpg"): img_id
+                        for img_id, url in to_fetch.items()
+                    }
+                    for fut in as_completed(futures):
+                        img_id = futures[fut]
+                        if fut.result():
+                            ready.put(img_dir / f"{img_id}.jpg")
+                            downloaded += 1
+                        else:
+                            logger.warning(f"Skip {img_id} (download failed)")
+            finally:
+                ready.put(None)
+            per_image, failed_ids = consumer.result()
 
-        if downloaded == 0:
+        for img_id, preds in per_image.items():
+            prediction_cache.set(_speciesnet_cache_key(url_by_id[img_id]), preds)
+        per_image.update(cached)
+
+        if downloaded == 0 and not cached:
             logger.info("Nothing downloaded; exiting.")
             return {
                 "success": False,
                 "images_processed": 0,
                 "attributions_created": 0,
+                "unattributed_ids": list(url_by_id),
                 "message": "Failed to download images"
             }
 
-        max_retries = 5
-        for attempt in range(1, max_retries + 1):
-            logger.info(f"🔁 SpeciesNet run attempt {attempt}/{max_retries}")
-            
-            # Delete old predictions to prevent resume errors
-            if output_json.exists():
-                output_json.unlink()
-            
-            ok = run_speciesnet_on_folder(img_dir, output_json)
-            if not ok or not output_json.exists():
-                logger.warning("No predictions file generated")
-                continue
+        if downloaded and len(failed_ids) == downloaded and not cached:
+            return {
+                "success": False,
+                "images_processed": 0,
+                "attributions_created": 0,
+                "unattributed_ids": list(url_by_id),
+                "message": "SpeciesNet inference failed"
+            }
 
-            per_image = parse_speciesnet_output(output_json, path_to_image_id, CONFIDENCE_THRESHOLD)
-
-            # Check if any still generic ("Bird"), re-run if needed
-            generic_left = []
-            for img_id, preds in per_image.items():
-                if any(p["name"].lower() == "bird" for p in preds):
-                    generic_left.append(img_id)
-
-            # Upsert everything that's not "Bird"
-            candidate_ids = [row["id"] for row in candidates]
-            for idx, img_id in enumerate(candidate_ids):
-                preds = [p for p in per_image.get(img_id, []) if p["name"].lower() != "bird"]
-                if preds:
-                    logger.info(f"Predictions for {img_id}:")
-                    for p in preds:
-                        logger.info(f"  - {p['name']}: {p['confidence']:.2%}")
-                else:
-                    logger.info(f"No species identified above threshold for {img_id}")
-                
-                # Get image URL for this image
-                img_url = next((r["image_url"] for r in candidates if r["id"] == img_id), None)
-                upsert_attributions(img_id, preds, image_url=img_url, check_first_time=True)
-                attributions_count += len(preds)
-                logger.info(f"✅ Saved {len(preds)} species attributions for {img_id}")
-                
-                # 100ms cooloff between upserts
-                if idx < len(candidate_ids) - 1:
-                    time.sleep(0.1)
-
-            if not generic_left:
-                break  # done
+        # Rerunning SpeciesNet on the same images gives the same answer, so anything
+        # still generic goes straight to the OpenAI fallback
+        generic_left = [
+            img_id for img_id, preds in per_image.items()
+            if any(p["name"].lower() == "bird" for p in preds)
+        ]
+
+        # Upsert everything that's not "Bird" in a single round-trip
+        pairs: List[Tuple[str, List[Dict]]] = []
+        failed = set(failed_ids)
+        for img_id in url_by_id:
+            if img_id in failed:
+                logger.warning(f"SpeciesNet inference failed for {img_id}")
+                continue
+            if img_id not in per_image:
+                continue  # download failed, already logged
+            preds = [p for p in per_image.get(img_id, []) if p["name"].lower() != "bird"]
+            if preds:
+                logger.info(f"Predictions for {img_id}:")
+                for p in preds:
+                    logger.info(f"  - {p['name']}: {p['confidence']:.2%}")
             else:
-                if attempt < max_retries:
-                    logger.info(f"{len(generic_left)} images returned generic 'Bird'; retrying...")
-                    # keep only those for reclassification
-                    for fp, iid in list(path_to_image_id.items()):
-                        if iid not in generic_left:
-                            del path_to_image_id[fp]
-                            try:
-                                Path(fp).unlink(missing_ok=True)
-                            except Exception:
-                                pass
-                    time.sleep(0.5)
-                else:
-                    # Final retry exhausted, fall back to OpenAI
-                    logger.info(f"⚠️  {len(generic_left)} images still generic after {max_retries} retries. Using OpenAI fallback...")
-                    for idx, img_id in enumerate(generic_left):
-                        # Find the original URL from candidates
-                        url = next((r["image_url"] for r in candidates if r["id"] == img_id), None)
-                        if not url:
-                            continue
-                        
-                        # Rate limiting: wait before each call (except the first)
-                        if idx > 0:
-                            logger.info(f"⏳ Waiting 3 seconds before next OpenAI call to respect rate limits...")
-                            time.sleep(3)
-                        
-                        logger.info(f"🤖 OpenAI fallback for {img_id} ({idx + 1}/{len(generic_left)})")
-                        openai_preds = classify_with_openai(url)
-                        
-                        if openai_preds:
-                            # Update with OpenAI results
-                            upsert_attributions(img_id, openai_preds, image_url=url, check_first_time=True)
-                            logger.info(f"✅ Saved {len(openai_preds)} OpenAI predictions for {img_id}")
-                        else:
-                            logger.info(f"⚠️  No OpenAI predictions for {img_id}")
-                    break
+                logger.info(f"No species identified above threshold for {img_id}")
+            pairs.append((img_id, preds))
+
+        saved = upsert_attributions_bulk(
+            pairs,
+            image_urls=url_by_id,
+            check_first_time=True
+        )
+        attributions_count += saved
+        attributed = {img_id for img_id, preds in pairs if preds}
+        logger.info(f"✅ Saved {saved} species attributions for {len(pairs)} images")
+
+        if generic_left:
+            logger.info(f"⚠️  {len(generic_left)} images returned generic 'Bird'. Using OpenAI fallback...")
+            # Bounded fan-out keeps us under the OpenAI rate limit; the client backs off on 429s
+            openai_results: List[Tuple[str, List[Dict]]] = []
+            with ThreadPoolExecutor(max_workers=OPENAI_CONCURRENCY) as ex:
+                futures = {}
+                for img_id in generic_left:
+                    url = url_by_id.get(img_id)
+                    if url:
+                        futures[ex.submit(classify_with_openai, url)] = img_id
+                for fut in as_completed(futures):
+                    img_id = futures[fut]
+                    openai_preds = fut.result()
+                    if openai_preds:
+                        logger.info(f"🤖 {len(openai_preds)} OpenAI predictions for {img_id}")
+                        openai_results.append((img_id, openai_preds))
+                    else:
+                        logger.info(f"⚠️  No OpenAI predictions for {img_id}")
+
+            if openai_results:
+                saved = upsert_attributions_bulk(
+                    openai_results,
+                    image_urls=url_by_id,
+                    check_first_time=True
+                )
+                attributions_count += saved
+                attributed.update(img_id for img_id, _ in openai_results)
+                logger.info(f"✅ Saved {saved} OpenAI predictions for {len(openai_results)} images")
 
     logger.info("✨ Batch complete.")
     return {
         "success": True,
         "images_processed": len(candidates),
         "attributions_created": attributions_count,
+        "unattributed_ids": [img_id for img_id in url_by_id if img_id not in attributed],
         "message": f"Processed {len(candidates)} images, created {attributions_count} attributions"
     }
 
@@ -446,7 +776,10 @@ def run_continuous(batch_size: Optional[int] = None) -> Dict:
     """Run continuous mode: process all unattributed images. Returns stats dict."""
     actual_batch_size = batch_size or BATCH_SIZE
     logger.info("🔄 Continuous mode: processing all unattributed images...")
-    total_processed = 0
+    handled: set = set()
+    # Images this run couldn't attribute (blank frames, failed downloads/inference, ...).
+    # They'd otherwise stay at the head of every batch, so later batches exclude them.
+    unattributed: set = set()
     total_attributions = 0
     batch_num = 1
     
@@ -456,35 +789,42 @@ def run_continuous(batch_size: Optional[int] = None) -> Dict:
         logger.info(f"{'='*60}")
         
         # Check how many unattributed images remain
-        candidates = get_candidate_images(actual_batch_size)
+        candidates = get_candidate_images(actual_batch_size, exclude_ids=unattributed)
+        candidates = [c for c in candidates if c["id"] not in handled]
         if not candidates:
-            logger.info("✅ All images have been attributed!")
             break
+        handled.update(c["id"] for c in candidates)
         
         logger.info(f"Found {len(candidates)} unattributed images in this batch")
         
         # Process this batch
-        result = run_batch(actual_batch_size)
-        if result.get("success"):
-            total_processed += result.get("images_processed", 0)
-            total_attributions += result.get("attributions_created", 0)
+        result = run_batch(actual_batch_size, candidates=candidates)
+        total_attributions += result.get("attributions_created", 0)
+        unattributed.update(result.get("unattributed_ids", []))
+        if not result.get("success"):
+            logger.warning(f"⚠️  Batch #{batch_num} failed: {result.get('message')}")
         
         batch_num += 1
         
-        logger.info(f"📊 Progress: {total_processed} images processed so far")
-        logger.info("⏸️  Pausing 2 seconds before next batch...")
-        time.sleep(2)
+        logger.info(f"📊 Progress: {len(handled)} images processed so far")
     
     logger.info(f"\n{'='*60}")
-    logger.info(f"🎉 Complete! Total images processed: {total_processed}")
+    if unattributed:
+        logger.warning(f"⚠️  Done, but {len(unattributed)} of {len(handled)} images could not be attributed")
+    else:
+        logger.info(f"🎉 Complete! Total images processed: {len(handled)}")
     logger.info(f"{'='*60}")
     
+    message = f"Processed {len(handled)} images in {batch_num - 1} batches, created {total_attributions} attributions"
+    if unattributed:
+        message += f"; {len(unattributed)} images left unattributed"
     return {
-        "success": True,
-        "images_processed": total_processed,
+        "success": not unattributed,
+        "images_processed": len(handled),
+        "images_unattributed": len(unattributed),
         "attributions_created": total_attributions,
         "batches_processed": batch_num - 1,
-        "message": f"Processed {total_processed} images in {batch_num - 1} batches, created {total_attributions} attributions"
+        "message": message
     }
 
 class AnalysisRequest(BaseModel):
@@ -525,10 +865,10 @@ def main():
     
     if args.continuous:
         result = run_continuous(args.batch_size)
-        print(json.dumps(result, indent=2))
+        print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
     else:
         result = run_batch(args.batch_size)
-        print(json.dumps(result, indent=2))
+        print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
 
 if __name__ == "__main__":
     main()
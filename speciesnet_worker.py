@@ -0,0 +1,97 @@
+# speciesnet_worker.py — long-lived SpeciesNet process driven over stdin/stdout
+#
+# Protocol: one JSON object per line in each direction.
+#   startup  -> {"ready": true}
+#   request  <- {"folders": [...]} or {"filepaths": [...]}, plus "predictions_json",
+#               "country", "admin1_region"
+#   response -> {"done": true} or {"done": false, "error": "..."}
+import os, sys, logging
+
+import orjson
+
+from speciesnet import DEFAULT_MODEL, SpeciesNet
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [speciesnet-worker] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+def _claim_stdout():
+    """Reserve the real stdout for the protocol and point fd 1 at stderr."""
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return protocol
+
+
+def _enable_mixed_precision(model, precision: str):
+    """Run the classifier's forward pass under CUDA autocast (fp16/bf16); fp32 on any failure."""
+    if precision == "fp32":
+        return
+    try:
+        classifier = getattr(model, "classifier", None)
+        if classifier is None or not str(classifier.device).startswith("cuda"):
+            return
+
+        import torch
+
+        dtype = torch.float16
+        if precision == "bf16" and torch.cuda.is_bf16_supported():
+            dtype = torch.bfloat16
+        net = classifier.model
+        forward = net.forward
+
+        def forward_autocast(*args, **kwargs):
+            with torch.autocast("cuda", dtype=dtype):
+                # SpeciesNet converts the logits to numpy, which has no bfloat16
+                return forward(*args, **kwargs).float()
+
+        net.forward = forward_autocast
+    except Exception as e:
+        logger.warning(f"Mixed precision unavailable, staying on fp32: {e}")
+        return
+    logger.info(f"Classifier running with {dtype} autocast")
+
+
+def _reply(out, payload: dict):
+    out.write(orjson.dumps(payload).decode() + "\n")
+    out.flush()
+
+
+def main():
+    out = _claim_stdout()
+
+    model_name = os.getenv("SPECIESNET_MODEL", DEFAULT_MODEL)
+    batch_size = int(os.getenv("SPECIESNET_BATCH_SIZE", "32"))
+    precision = os.getenv("SPECIESNET_PRECISION", "bf16").lower()
+    logger.info(f"Loading SpeciesNet model {model_name}...")
+    model = SpeciesNet(model_name)
+    _enable_mixed_precision(model, precision)
+    logger.info("Model loaded; waiting for jobs")
+    _reply(out, {"ready": True})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = orjson.loads(line)
+            model.predict(
+                folders=job.get("folders"),
+                filepaths=job.get("filepaths"),
+                country=job.get("country"),
+                admin1_region=job.get("admin1_region"),
+                batch_size=batch_size,
+                predictions_json=job["predictions_json"],
+            )
+            _reply(out, {"done": True})
+        except Exception as e:
+            logger.exception("Inference job failed")
+            _reply(out, {"done": False, "error": str(e)})
+
+
+if __name__ == "__main__":
+    main()